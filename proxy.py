@@ -1,13 +1,14 @@
-import json
 import logging
 import os
-import random
-import string
+import secrets
+from contextlib import asynccontextmanager
 from typing import Any
 
 import httpx
-from fastapi import FastAPI, Request, Response
-from fastapi.responses import StreamingResponse
+import msgspec
+import orjson
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
 # --- Configuration ---
 # Set up basic logging
@@ -32,27 +33,106 @@ DEFAULT_MODEL = os.getenv('MODEL') or 'my-model'
 REASONING_MODEL = os.getenv('REASONING_MODEL') or DEFAULT_MODEL
 COMPLETION_MODEL = os.getenv('COMPLETION_MODEL') or DEFAULT_MODEL
 
-app = FastAPI()
+# Shared upstream client so connections (and HTTP/2 streams) are reused across requests
+HTTP_CLIENT = httpx.AsyncClient(
+    base_url=OPENAI_API_BASE,
+    timeout=httpx.Timeout(300.0, connect=10.0),
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+    http2=True,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await HTTP_CLIENT.aclose()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+
+# --- SSE Frames ---
+EVT_CONTENT_BLOCK_START = b'content_block_start'
+EVT_CONTENT_BLOCK_DELTA = b'content_block_delta'
+EVT_CONTENT_BLOCK_STOP = b'content_block_stop'
+EVT_MESSAGE_DELTA = b'message_delta'
+
+# Constant frames (and the fixed framing around streamed text) are serialized once up front
+# message_start only varies by message id and model: `MESSAGE_START_TEMPLATE % (message_id, orjson.dumps(model))`
+MESSAGE_START_TEMPLATE = (
+    b'event: message_start\n'
+    b'data: {"type":"message_start","message":{"id":"%s","type":"message","role":"assistant","model":%s,'
+    b'"content":[],"stop_reason":null,"stop_sequence":null,"usage":{"input_tokens":0,"output_tokens":0}}}\n\n'
+)
+PING_FRAME = b'event: ping\ndata: {"type":"ping"}\n\n'
+MESSAGE_STOP_FRAME = b'event: message_stop\ndata: {"type":"message_stop"}\n\n'
+TEXT_BLOCK_START_FRAME = (
+    b'event: content_block_start\n'
+    b'data: {"type":"content_block_start","index":0,"content_block":{"type":"text","text":""}}\n\n'
+)
+CONTENT_DELTA_PREFIX = (
+    b'event: content_block_delta\ndata: {"type":"content_block_delta","index":0,"delta":{"type":"text_delta","text":'
+)
+CONTENT_DELTA_SUFFIX = b'}}\n\n'
+
+# --- Request Models ---
+# The inbound Anthropic request is decoded straight into these structs; unknown fields are ignored
+
+
+class ContentBlock(msgspec.Struct):
+    type: str
+    text: str = ''
+    id: str = ''
+    name: str = ''
+    # Tool input is kept as the undecoded JSON from the request and forwarded verbatim as the call arguments
+    input: msgspec.Raw = msgspec.Raw(b'{}')
+    content: Any = ''
+    tool_use_id: str | None = None
+
+
+class AnthropicMessage(msgspec.Struct):
+    role: str
+    content: str | list[ContentBlock] | None = None
+
+
+class AnthropicRequest(msgspec.Struct):
+    messages: list[AnthropicMessage] = []
+    system: Any = None
+    tools: list = []
+    max_tokens: int = 4096
+    temperature: float = 1.0
+    stream: bool = False
+    # Only its truthiness matters, so accept both `true` and Anthropic's `{"type": "enabled", ...}` object
+    thinking: Any = None
+    model: str | None = None
+
+
+# --- Lookup Tables ---
+# OpenAI finish_reason -> Anthropic stop_reason
+STOP_REASON_MAP = {
+    'tool_calls': 'tool_use',
+    'stop': 'end_turn',
+    'length': 'max_tokens',
+}
+
+# Tool schemas are usually identical from one request to the next, so their cleaned-up form is cached
+SCHEMA_CACHE_SIZE = 1024
+_SCHEMA_CACHE: dict[bytes, Any] = {}
 
 # --- Helper Functions ---
 # (Helper functions like debug_log, map_stop_reason, etc. remain the same)
 
 
-def debug_log(*args):
-    """Prints debug messages if DEBUG is enabled."""
+def debug_log(msg: str, *args):
+    """Logs a debug message if DEBUG is enabled; `args` are %-formatted lazily by the logger."""
     if IS_DEBUG:
-        logger.info(' '.join(map(str, args)))
+        logger.info(msg, *args)
 
 
 def map_stop_reason(finish_reason: str | None) -> str:
     """Maps OpenAI's finish_reason to Anthropic's stop_reason."""
     if not finish_reason:
         return 'end_turn'
-    return {
-        'tool_calls': 'tool_use',
-        'stop': 'end_turn',
-        'length': 'max_tokens',
-    }.get(finish_reason, 'end_turn')
+    return STOP_REASON_MAP.get(finish_reason, 'end_turn')
 
 
 def normalize_content(content: Any) -> str | None:
@@ -64,52 +144,156 @@ def normalize_content(content: Any) -> str | None:
     return None
 
 
-def remove_uri_format(schema: Any) -> Any:
-    """Recursively removes 'format: uri' from a JSON schema."""
-    if isinstance(schema, dict):
-        if schema.get('type') == 'string' and schema.get('format') == 'uri':
-            return {k: v for k, v in schema.items() if k != 'format'}
-        return {key: remove_uri_format(value) for key, value in schema.items()}
-    if isinstance(schema, list):
-        return [remove_uri_format(item) for item in schema]
+def _strip_uri_format(schema: Any) -> Any:
+    """Removes 'format: uri' from a JSON schema in place, walking it with an explicit stack."""
+    stack = [schema]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if node.get('type') == 'string' and node.get('format') == 'uri':
+                del node['format']
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
     return schema
 
 
+def remove_uri_format(schema: Any) -> Any:
+    """Removes 'format: uri' from a JSON schema, reusing the result for schemas seen before."""
+    key = orjson.dumps(schema, option=orjson.OPT_SORT_KEYS)
+    cached = _SCHEMA_CACHE.get(key)
+    if cached is None:
+        cached = _SCHEMA_CACHE[key] = _strip_uri_format(schema)
+        # Evict the oldest entry once the cache is full
+        if len(_SCHEMA_CACHE) > SCHEMA_CACHE_SIZE:
+            del _SCHEMA_CACHE[next(iter(_SCHEMA_CACHE))]
+    return cached
+
+
 def generate_message_id(prefix='msg'):
     """Generates a random message ID."""
-    random_part = ''.join(random.choices(string.ascii_lowercase + string.digits, k=24))
-    return f'{prefix}_{random_part}'
+    return f'{prefix}_{secrets.token_hex(12)}'
+
+
+async def iter_sse_batches(response: httpx.Response):
+    """Yields the raw payloads of the upstream SSE `data:` lines, one list per network read, until `[DONE]`."""
+    buf = bytearray()
+    async for chunk in response.aiter_bytes():
+        buf += chunk
+        batch = []
+        while (nl := buf.find(b'\n')) != -1:
+            line = bytes(buf[:nl])
+            del buf[: nl + 1]
+            if not line.startswith(b'data:'):
+                continue
+            data = line[5:].strip()
+            if data == b'[DONE]':
+                if batch:
+                    yield batch
+                return
+            batch.append(data)
+        if batch:
+            yield batch
+    # Flush a trailing line that was not newline-terminated
+    if buf.startswith(b'data:'):
+        data = bytes(buf[5:]).strip()
+        if data != b'[DONE]':
+            yield [data]
+
+
+def sse_pack(event: bytes, data: dict) -> bytes:
+    """Packs an SSE frame as bytes; OPT_APPEND_NEWLINE supplies the first of the two terminating newlines."""
+    return b'event: ' + event + b'\ndata: ' + orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE) + b'\n'
+
+
+def _json_value_offset(data: bytes, key: bytes) -> int:
+    """Returns the offset of the value following the quoted `key` in raw JSON, or -1 if the key is absent."""
+    pos = data.find(key)
+    if pos == -1:
+        return -1
+    pos += len(key)
+    while data[pos : pos + 1] in (b' ', b':'):
+        pos += 1
+    return pos
+
+
+def extract_text_delta(data: bytes) -> bytes | None:
+    """Returns the text of a plain content delta chunk as its raw JSON string literal, without parsing the chunk.
+
+    Returns None for anything else (tool calls, usage, a finish reason, empty content) so the caller falls back
+    to a full parse. Quotes inside JSON strings are always escaped, so key lookups cannot match inside values.
+    """
+    if b'"tool_calls"' in data or data.count(b'"content"') != 1:
+        return None
+    for key in (b'"finish_reason"', b'"usage"'):
+        pos = _json_value_offset(data, key)
+        if pos != -1 and not data.startswith(b'null', pos):
+            return None
+
+    start = _json_value_offset(data, b'"content"')
+    if not data.startswith(b'"', start):
+        return None
+    end = start
+    while True:
+        end = data.find(b'"', end + 1)
+        if end == -1:
+            return None
+        # A quote preceded by an odd number of backslashes is escaped
+        backslashes = 0
+        while data[end - 1 - backslashes] == 0x5C:
+            backslashes += 1
+        if not backslashes % 2:
+            break
+    if end == start + 1:
+        return None
+    return data[start : end + 1]
 
 
 @app.post('/v1/messages')
 async def messages_proxy(request: Request):
     try:
-        payload = await request.json()
-        is_stream = payload.get('stream', False)
+        payload = msgspec.json.decode(await request.body(), type=AnthropicRequest)
+        is_stream = payload.stream
 
         # 1. Translate Anthropic request to OpenAI format
         # This part of the logic remains unchanged as it prepares a standard OpenAI payload
         messages = []
-        if 'system' in payload:
-            system_content = normalize_content(payload['system'])
+        if payload.system is not None:
+            system_content = normalize_content(payload.system)
             if system_content:
                 messages.append({'role': 'system', 'content': system_content})
 
-        for msg in payload.get('messages', []):
-            role = msg.get('role')
-            content = msg.get('content')
-            normalized_text = normalize_content(content)
+        for msg in payload.messages:
+            role = msg.role
+            content = msg.content
             tool_calls = []
+            tool_results = []
             if isinstance(content, list):
-                tool_calls = [
-                    {
-                        'type': 'function',
-                        'id': item['id'],
-                        'function': {'name': item['name'], 'arguments': json.dumps(item['input'])},
-                    }
-                    for item in content
-                    if item.get('type') == 'tool_use'
-                ]
+                # Single pass over the content blocks: text, tool calls and tool results
+                texts = []
+                for item in content:
+                    item_type = item.type
+                    if item_type == 'text':
+                        texts.append(item.text)
+                    elif item_type == 'tool_use':
+                        tool_calls.append(
+                            {
+                                'type': 'function',
+                                'id': item.id,
+                                'function': {'name': item.name, 'arguments': bytes(item.input).decode()},
+                            }
+                        )
+                    elif item_type == 'tool_result':
+                        tool_results.append(
+                            {
+                                'role': 'tool',
+                                'content': item.content,
+                                'tool_call_id': item.tool_use_id,
+                            }
+                        )
+                normalized_text = ' '.join(texts) if texts else None
+            else:
+                normalized_text = normalize_content(content)
 
             new_msg = {'role': role}
             if normalized_text:
@@ -119,17 +303,7 @@ async def messages_proxy(request: Request):
 
             if new_msg.get('content') or new_msg.get('tool_calls'):
                 messages.append(new_msg)
-
-            if isinstance(content, list):
-                for item in content:
-                    if item.get('type') == 'tool_result':
-                        messages.append(
-                            {
-                                'role': 'tool',
-                                'content': item.get('content', ''),
-                                'tool_call_id': item.get('tool_use_id'),
-                            }
-                        )
+            messages.extend(tool_results)
 
         tools = [
             {
@@ -140,48 +314,48 @@ async def messages_proxy(request: Request):
                     'parameters': remove_uri_format(tool['input_schema']),
                 },
             }
-            for tool in payload.get('tools', [])
+            for tool in payload.tools
         ]
 
         openai_payload = {
-            'model': REASONING_MODEL if payload.get('thinking') else COMPLETION_MODEL,
+            'model': REASONING_MODEL if payload.thinking else COMPLETION_MODEL,
             'messages': messages,
-            'max_tokens': payload.get('max_tokens', 4096),
-            'temperature': payload.get('temperature', 1.0),
+            'max_tokens': payload.max_tokens,
+            'temperature': payload.temperature,
             'stream': is_stream,
         }
         if tools:
             openai_payload['tools'] = tools
 
-        debug_log('OpenAI Payload:', json.dumps(openai_payload, indent=2))
+        if IS_DEBUG:
+            debug_log('OpenAI Payload: %s', orjson.dumps(openai_payload, option=orjson.OPT_INDENT_2).decode())
 
         # 2. Forward request to your custom OpenAI-compatible API
         headers = {'Content-Type': 'application/json'}
         if OPENAI_API_KEY:
             headers['Authorization'] = f'Bearer {OPENAI_API_KEY}'
 
-        # The URL for the target service is now built from OPENAI_API_BASE
-        api_url = f'{OPENAI_API_BASE}/chat/completions'
-
+        # Encode the upstream body once with orjson rather than letting httpx run it through stdlib json
+        model = openai_payload['model']
+        body = orjson.dumps(openai_payload)
         if not is_stream:
-            return await handle_non_stream(api_url, openai_payload, headers)
+            return await handle_non_stream(model, body, headers)
         else:
-            return StreamingResponse(stream_generator(api_url, openai_payload, headers), media_type='text/event-stream')
+            return StreamingResponse(stream_generator(model, body, headers), media_type='text/event-stream')
 
     except Exception as e:
         logger.error(f'An error occurred: {e}', exc_info=True)
-        return Response(content=json.dumps({'error': str(e)}), status_code=500, media_type='application/json')
+        return ORJSONResponse({'error': str(e)}, status_code=500)
 
 
-async def handle_non_stream(url: str, payload: dict, headers: dict):
+async def handle_non_stream(model: str, body: bytes, headers: dict):
     """Handles the non-streaming API response."""
-    # This function logic remains the same
-    async with httpx.AsyncClient(timeout=300) as client:
-        response = await client.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        data = response.json()
+    response = await HTTP_CLIENT.post('/chat/completions', content=body, headers=headers)
+    response.raise_for_status()
+    data = orjson.loads(response.content)
 
-    debug_log('Custom API Response:', json.dumps(data, indent=2))
+    if IS_DEBUG:
+        debug_log('Custom API Response: %s', orjson.dumps(data, option=orjson.OPT_INDENT_2).decode())
 
     choice = data['choices'][0]
     openai_message = choice['message']
@@ -196,7 +370,7 @@ async def handle_non_stream(url: str, payload: dict, headers: dict):
                 'type': 'tool_use',
                 'id': tool_call['id'],
                 'name': tool_call['function']['name'],
-                'input': json.loads(tool_call['function']['arguments']),
+                'input': orjson.loads(tool_call['function']['arguments']),
             }
         )
 
@@ -204,7 +378,7 @@ async def handle_non_stream(url: str, payload: dict, headers: dict):
         'id': data.get('id', '').replace('chatcmpl', 'msg') or generate_message_id(),
         'type': 'message',
         'role': openai_message.get('role', 'assistant'),
-        'model': payload['model'],
+        'model': model,
         'content': content_parts,
         'stop_reason': map_stop_reason(choice.get('finish_reason')),
         'stop_sequence': None,
@@ -214,56 +388,42 @@ async def handle_non_stream(url: str, payload: dict, headers: dict):
         },
     }
 
-    return Response(content=json.dumps(anthropic_response), media_type='application/json')
+    return ORJSONResponse(anthropic_response)
 
 
-async def stream_generator(url: str, payload: dict, headers: dict):
+async def stream_generator(model: str, body: bytes, headers: dict):
     """Handles the streaming API response and translates SSE events."""
-    # This function logic remains the same
     message_id = generate_message_id()
 
-    def sse_pack(event: str, data: dict) -> str:
-        return f'event: {event}\ndata: {json.dumps(data)}\n\n'
-
-    yield sse_pack(
-        'message_start',
-        {
-            'type': 'message_start',
-            'message': {
-                'id': message_id,
-                'type': 'message',
-                'role': 'assistant',
-                'model': payload['model'],
-                'content': [],
-                'stop_reason': None,
-                'stop_sequence': None,
-                'usage': {'input_tokens': 0, 'output_tokens': 0},
-            },
-        },
-    )
-    yield sse_pack('ping', {'type': 'ping'})
+    # Message ids are generated from hex, so only the model name needs JSON escaping
+    yield MESSAGE_START_TEMPLATE % (message_id.encode(), orjson.dumps(model))
+    yield PING_FRAME
 
     text_block_started = False
     tool_call_accumulators: dict[int, dict] = {}
     usage = {}
     last_chunk = {}
 
-    async with httpx.AsyncClient(timeout=300) as client:
-        async with client.stream('POST', url, json=payload, headers=headers, timeout=300) as response:
-            response.raise_for_status()
-            async for line in response.aiter_lines():
-                if not line.startswith('data:'):
+    async with HTTP_CLIENT.stream('POST', '/chat/completions', content=body, headers=headers) as response:
+        response.raise_for_status()
+        # Frames produced from one upstream read are sent to the client as a single write
+        async for batch in iter_sse_batches(response):
+            frames = bytearray()
+            for data in batch:
+                # Fast path: plain text deltas are spliced into the Anthropic frame without a parse/re-encode
+                text = extract_text_delta(data)
+                if text is not None:
+                    if not text_block_started:
+                        frames += TEXT_BLOCK_START_FRAME
+                        text_block_started = True
+                    frames += CONTENT_DELTA_PREFIX + text + CONTENT_DELTA_SUFFIX
                     continue
 
-                data_str = line[len('data: ') :].strip()
-                if data_str == '[DONE]':
-                    break
-
                 try:
-                    chunk = json.loads(data_str)
+                    chunk = orjson.loads(data)
                     last_chunk = chunk
-                except json.JSONDecodeError:
-                    debug_log('Failed to parse JSON chunk:', data_str)
+                except orjson.JSONDecodeError:
+                    debug_log('Failed to parse JSON chunk: %s', data)
                     continue
 
                 if chunk.get('usage'):
@@ -275,19 +435,9 @@ async def stream_generator(url: str, payload: dict, headers: dict):
 
                 if delta.get('content'):
                     if not text_block_started:
-                        yield sse_pack(
-                            'content_block_start',
-                            {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}},
-                        )
+                        frames += TEXT_BLOCK_START_FRAME
                         text_block_started = True
-                    yield sse_pack(
-                        'content_block_delta',
-                        {
-                            'type': 'content_block_delta',
-                            'index': 0,
-                            'delta': {'type': 'text_delta', 'text': delta['content']},
-                        },
-                    )
+                    frames += CONTENT_DELTA_PREFIX + orjson.dumps(delta['content']) + CONTENT_DELTA_SUFFIX
 
                 if delta.get('tool_calls'):
                     for tool_call_delta in delta['tool_calls']:
@@ -297,8 +447,8 @@ async def stream_generator(url: str, payload: dict, headers: dict):
                             func_info = tool_call_delta.get('function', {})
                             tool_call_accumulators[idx]['id'] = tool_call_delta.get('id', '')
                             tool_call_accumulators[idx]['name'] = func_info.get('name', '')
-                            yield sse_pack(
-                                'content_block_start',
+                            frames += sse_pack(
+                                EVT_CONTENT_BLOCK_START,
                                 {
                                     'type': 'content_block_start',
                                     'index': idx,
@@ -314,37 +464,41 @@ async def stream_generator(url: str, payload: dict, headers: dict):
                         arg_chunk = tool_call_delta.get('function', {}).get('arguments', '')
                         if arg_chunk:
                             tool_call_accumulators[idx]['args'] += arg_chunk
-                            yield sse_pack(
-                                'content_block_delta',
+                            frames += sse_pack(
+                                EVT_CONTENT_BLOCK_DELTA,
                                 {
                                     'type': 'content_block_delta',
                                     'index': idx,
                                     'delta': {'type': 'input_json_delta', 'partial_json': arg_chunk},
                                 },
                             )
+            if frames:
+                yield bytes(frames)
 
     finish_reason = last_chunk.get('choices', [{}])[0].get('finish_reason')
     stop_reason = map_stop_reason(finish_reason)
 
+    closing = bytearray()
     if tool_call_accumulators:
         for idx in tool_call_accumulators:
-            yield sse_pack('content_block_stop', {'type': 'content_block_stop', 'index': idx})
+            closing += sse_pack(EVT_CONTENT_BLOCK_STOP, {'type': 'content_block_stop', 'index': idx})
     elif text_block_started:
-        yield sse_pack('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        closing += sse_pack(EVT_CONTENT_BLOCK_STOP, {'type': 'content_block_stop', 'index': 0})
 
-    yield sse_pack(
-        'message_delta',
+    closing += sse_pack(
+        EVT_MESSAGE_DELTA,
         {
             'type': 'message_delta',
             'delta': {'stop_reason': stop_reason, 'stop_sequence': None},
             'usage': {'output_tokens': usage.get('completion_tokens', 0)},
         },
     )
-    yield sse_pack('message_stop', {'type': 'message_stop'})
+    closing += MESSAGE_STOP_FRAME
+    yield bytes(closing)
 
 
 if __name__ == '__main__':
     import uvicorn
 
     port = int(os.getenv('PORT', 3000))
-    uvicorn.run(app, host='0.0.0.0', port=port)
+    uvicorn.run(app, host='0.0.0.0', port=port, loop='uvloop', http='httptools', log_level='warning')
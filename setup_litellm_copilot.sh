@@ -21,8 +21,8 @@ echo ""
 echo "👉 Installing LiteLLM (with proxy support)..."
 pip install "litellm[proxy]"
 
-echo "👉 Installing FastAPI, httpx, uvicorn (proxy dependencies)..."
-pip install fastapi httpx uvicorn
+echo "👉 Installing FastAPI, httpx (with HTTP/2), uvicorn (with uvloop/httptools), orjson, msgspec (proxy dependencies)..."
+pip install fastapi "httpx[http2]" "uvicorn[standard]" orjson msgspec
 
 # Step 4: Patch for Copilot debug (optional)
 echo ""